@@ -15,17 +15,35 @@ Data source: https://pittsburghpa.gov/dpw/snow-plow-tracker
 """
 
 import argparse
+import hashlib
+import heapq
 import json
 import math
 import os
 import re
 import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from urllib.request import urlopen, Request
 from urllib.error import HTTPError, URLError
 from urllib.parse import quote_plus, urlencode
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson parses bytes directly and much faster; its errors subclass JSONDecodeError
+json_loads = orjson.loads if orjson else json.loads
+
 # ArcGIS REST API endpoints
 VEHICLES_URL = "https://services1.arcgis.com/YZCmUqbcsUpOKfj7/arcgis/rest/services/TEST_TEST/FeatureServer/0/query"
 HISTORY_URL = "https://pghbridgis.pittsburghpa.gov/hosting/rest/services/Hosted/samsara_history/FeatureServer/0/query"
@@ -33,34 +51,137 @@ HISTORY_URL = "https://pghbridgis.pittsburghpa.gov/hosting/rest/services/Hosted/
 # Nominatim for geocoding
 NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
 
+REQUEST_HEADERS = {"User-Agent": "SnowPlow-Skill/1.0"}
+
+GEOCODE_CACHE_TTL = 30 * 24 * 3600  # Seconds
+VEHICLES_CACHE_TTL = 30  # Seconds
+HISTORY_CACHE_TTL = 5 * 60  # Seconds
+
+STATUS_MOVING = "🟢 Moving"
+STATUS_STOPPED = "🔴 Stopped"
+
+_ZIP_RE = re.compile(r"^\d{5}$")
+_WHITESPACE_RE = re.compile(r"\s+")
+_TOOLS_RE = re.compile(
+    r"##\s*Snow\s*Plow.*?Default address:\s*(.+?)(?:\n|$)",
+    re.IGNORECASE | re.DOTALL
+)
 
-def fetch_json(url: str, params: dict = None) -> dict:
-    """Fetch JSON from a URL with optional query parameters."""
+def fetch_json(url: str, params: dict = None, ttl: float = 0) -> dict:
+    """Fetch JSON from a URL with optional query parameters.
+    
+    With a positive ttl, successful responses are cached on disk and reused
+    for that many seconds.
+    """
+    cache_path = None
+    if ttl > 0:
+        key = repr((url, sorted((params or {}).items())))
+        cache_path = get_cache_dir() / "responses" / f"{hashlib.sha1(key.encode()).hexdigest()}.json"
+        try:
+            if time.time() - cache_path.stat().st_mtime < ttl:
+                return json_loads(cache_path.read_bytes())
+        except (OSError, ValueError):
+            pass
+    
     if params:
         url = f"{url}?{urlencode(params)}"
     
     try:
-        req = Request(url, headers={"User-Agent": "SnowPlow-Skill/1.0"})
+        req = Request(url, headers=REQUEST_HEADERS)
         with urlopen(req, timeout=30) as response:
-            return json.loads(response.read().decode())
+            body = response.read()
+        data = json_loads(body)
     except (HTTPError, URLError) as e:
         print(f"Error fetching data: {e}", file=sys.stderr)
         return {}
     except json.JSONDecodeError as e:
         print(f"Error parsing response: {e}", file=sys.stderr)
         return {}
+    
+    # ArcGIS reports query errors in a 200 response; don't cache those
+    if cache_path and data and "error" not in data:
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_bytes(body)  # Raw payload; no re-encoding, age is the mtime
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+        
+        # Keys roll over with every history window, so drop entries no TTL can still hit
+        cutoff = time.time() - max(VEHICLES_CACHE_TTL, HISTORY_CACHE_TTL)
+        try:
+            for path in cache_path.parent.iterdir():
+                if path.suffix in (".json", ".tmp") and path.stat().st_mtime < cutoff:
+                    path.unlink()
+        except OSError:
+            pass
+    
+    return data
+
+
+def get_cache_dir() -> Path:
+    """Return the directory used for on-disk caches."""
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "plow-tracker"
+
+
+def load_cached_geocode(key: str) -> tuple[float, float] | None:
+    """Look up unexpired coordinates for a normalized location."""
+    path = get_cache_dir() / "geocode.json"
+    try:
+        with open(path) as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_SH)
+            entry = json.load(f).get(key)
+        if entry and time.time() - entry["ts"] < GEOCODE_CACHE_TTL:
+            return entry["lat"], entry["lon"]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        pass
+    return None
+
+
+def save_cached_geocode(key: str, coords: tuple[float, float]) -> None:
+    """Store coordinates for a normalized location, dropping expired entries."""
+    path = get_cache_dir() / "geocode.json"
+    now = time.time()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a+") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                cache = json.loads(f.read() or "{}")
+            except ValueError:
+                cache = {}
+            cache = {
+                k: v for k, v in cache.items()
+                if isinstance(v, dict) and now - v.get("ts", 0) < GEOCODE_CACHE_TTL
+            }
+            cache[key] = {"lat": coords[0], "lon": coords[1], "ts": now}
+            f.seek(0)
+            f.truncate()
+            json.dump(cache, f)
+    except OSError:
+        pass
 
 
 def geocode_location(location: str) -> tuple[float, float] | None:
     """Convert a location string to coordinates using Nominatim."""
     # Check if it looks like a zip code
-    if re.match(r"^\d{5}$", location.strip()):
+    if _ZIP_RE.match(location.strip()):
         location = f"{location}, PA"
     
     # Add Pittsburgh context if needed
     if not any(x in location.lower() for x in ["pa", "pennsylvania", "pittsburgh", ","]):
         location = f"{location}, Pittsburgh, PA"
     
+    cache_key = _WHITESPACE_RE.sub(" ", location.lower().strip())
+    coords = load_cached_geocode(cache_key)
+    if coords:
+        return coords
+    
     try:
         params = {
             "q": location,
@@ -68,35 +189,58 @@ def geocode_location(location: str) -> tuple[float, float] | None:
             "limit": 1
         }
         url = f"{NOMINATIM_URL}?{urlencode(params)}"
-        req = Request(url, headers={"User-Agent": "SnowPlow-Skill/1.0"})
+        req = Request(url, headers=REQUEST_HEADERS)
         with urlopen(req, timeout=10) as response:
-            results = json.loads(response.read().decode())
-            if results:
-                return float(results[0]["lat"]), float(results[0]["lon"])
+            results = json_loads(response.read())
+        if results:
+            coords = float(results[0]["lat"]), float(results[0]["lon"])
+            save_cached_geocode(cache_key, coords)
+            return coords
     except Exception as e:
         print(f"Geocoding failed: {e}", file=sys.stderr)
     
     return None
 
 
-def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calculate distance between two points in miles."""
-    R = 3959  # Earth's radius in miles
-    
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
+def find_nearby(lat: float, lon: float, points: list[dict], radius_miles: float) -> list[tuple[dict, float]]:
+    """Return (point, distance in miles) for every point within radius of (lat, lon).
     
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
+    Uses an equirectangular approximation, which is accurate to about a
+    foot at the few-mile radii used here and needs no trig per point.
+    """
+    miles_per_degree = 3959 * math.pi / 180  # Earth's radius in miles, per degree
+    cos_lat0 = math.cos(math.radians(lat))
+    max_dlat = radius_miles / miles_per_degree
+    max_dlon = max_dlat / cos_lat0
+    max_d2 = max_dlat * max_dlat
     
-    return R * c
-
-
-def parse_timestamp(ts_str: str) -> datetime | None:
-    """Parse a timestamp string to datetime."""
+    results = []
+    for point in points:
+        if not (point.get("lat") and point.get("lon")):
+            continue
+        # Bounding-box reject first; most of a city-wide feed is far away
+        dy = point["lat"] - lat
+        if not -max_dlat <= dy <= max_dlat:
+            continue
+        dlon = point["lon"] - lon
+        if not -max_dlon <= dlon <= max_dlon:
+            continue
+        dx = dlon * cos_lat0
+        d2 = dx * dx + dy * dy
+        # Compare squared distances; sqrt only for the points we keep
+        if d2 <= max_d2:
+            results.append((point, math.sqrt(d2) * miles_per_degree))
+    
+    return results
+
+
+def parse_timestamp(ts_str: str | int | float) -> datetime | None:
+    """Parse an epoch-milliseconds number or timestamp string to datetime."""
     if not ts_str:
         return None
+    if isinstance(ts_str, (int, float)):
+        # ArcGIS date fields come back as epoch milliseconds
+        return datetime.fromtimestamp(ts_str / 1000, tz=timezone.utc)
     try:
         # Handle ISO format with Z
         if ts_str.endswith('Z'):
@@ -139,22 +283,20 @@ def get_default_address() -> str | None:
     workspace_paths = [
         Path.home() / "clawd" / "TOOLS.md",
         Path.cwd() / "TOOLS.md",
-        Path(os.environ.get("CLAWDBOT_WORKSPACE", "")) / "TOOLS.md",
     ]
+    # An unset workspace would just resolve to the cwd again
+    if os.environ.get("CLAWDBOT_WORKSPACE"):
+        workspace_paths.append(Path(os.environ["CLAWDBOT_WORKSPACE"]) / "TOOLS.md")
     
     for tools_path in workspace_paths:
-        if tools_path.exists():
-            try:
-                content = tools_path.read_text()
-                match = re.search(
-                    r"##\s*Snow\s*Plow.*?Default address:\s*(.+?)(?:\n|$)",
-                    content,
-                    re.IGNORECASE | re.DOTALL
-                )
-                if match:
-                    return match.group(1).strip()
-            except Exception:
-                pass
+        # Read directly rather than exists() then read; a missing file is one failed open
+        try:
+            content = tools_path.read_text()
+        except (OSError, UnicodeDecodeError):
+            continue
+        match = _TOOLS_RE.search(content)
+        if match:
+            return match.group(1).strip()
     return None
 
 
@@ -167,27 +309,38 @@ def get_vehicles() -> list[dict]:
         "resultRecordCount": 500
     }
     
-    data = fetch_json(VEHICLES_URL, params)
+    data = fetch_json(VEHICLES_URL, params, ttl=VEHICLES_CACHE_TTL)
     
+    # Normalize name and speed once here so the display loops can index directly
     vehicles = []
     for feature in data.get("features", []):
         attr = feature.get("attributes", {})
         vehicles.append({
-            "name": attr.get("name"),
+            "name": attr.get("name") or "",
             "time": parse_timestamp(attr.get("gps_time")),
             "lat": attr.get("gps_latitude"),
             "lon": attr.get("gps_longitude"),
-            "speed": attr.get("gps_speedMilesPerHour", 0),
+            "speed": attr.get("gps_speedMilesPerHour") or 0.0,
             "heading": attr.get("gps_headingDegrees"),
         })
     
     return vehicles
 
 
-def get_route_history(hours: int = 12, vehicle: str = None) -> list[dict]:
-    """Fetch route history."""
-    # Calculate time window
+def get_route_history(
+    hours: int = 12,
+    vehicle: str = None,
+    center: tuple[float, float] = None,
+    radius_feet: float = None,
+) -> list[dict] | None:
+    """Fetch route history, optionally only points within radius_feet of center.
+    
+    Returns None if the query failed, so callers can tell that apart from an
+    empty result.
+    """
+    # Calculate time window, aligned to the cache TTL so repeat queries share a key
     now = datetime.now(timezone.utc)
+    now -= timedelta(seconds=now.timestamp() % HISTORY_CACHE_TTL)
     start_time = now - timedelta(hours=hours)
     
     # Build where clause
@@ -203,7 +356,27 @@ def get_route_history(hours: int = 12, vehicle: str = None) -> list[dict]:
         "orderByFields": "gps_time DESC"
     }
     
-    data = fetch_json(HISTORY_URL, params)
+    # Let the server do the spatial filtering instead of downloading the whole city
+    spatial_params = {}
+    if center and radius_feet:
+        lat, lon = center
+        spatial_params = {
+            "geometry": f"{lon},{lat}",
+            "geometryType": "esriGeometryPoint",
+            "inSR": 4326,
+            "spatialRel": "esriSpatialRelIntersects",
+            "distance": radius_feet,
+            "units": "esriSRUnit_Foot",
+        }
+    
+    data = fetch_json(HISTORY_URL, {**params, **spatial_params}, ttl=HISTORY_CACHE_TTL)
+    if spatial_params and "error" in data:
+        # Service rejected the spatial query; fall back to the unfiltered window
+        data = fetch_json(HISTORY_URL, params, ttl=HISTORY_CACHE_TTL)
+    
+    # fetch_json returns {} on network/parse errors; ArcGIS errors come back as {"error": ...}
+    if not data or "error" in data:
+        return None
     
     points = []
     for feature in data.get("features", []):
@@ -234,10 +407,10 @@ def cmd_status(args):
     
     # Filter to active if requested
     if args.active:
-        vehicles = [v for v in vehicles if v.get("speed", 0) > 0.5]
+        vehicles = [v for v in vehicles if v["speed"] > 0.5]
     
     # Sort by speed (active first), then name
-    vehicles.sort(key=lambda v: (-v.get("speed", 0), v.get("name", "")))
+    vehicles.sort(key=lambda v: (-v["speed"], v["name"]))
     
     if not vehicles:
         print("No active plows currently moving.")
@@ -245,25 +418,34 @@ def cmd_status(args):
     
     print(f"{'🚛 Active' if args.active else '📊 All'} Snow Plows ({len(vehicles)} vehicles):\n")
     
+    # Build the whole listing and write it once instead of five print() calls per vehicle
+    lines = []
     for v in vehicles:
-        speed = v.get("speed", 0)
-        status = "🟢 Moving" if speed > 0.5 else "🔴 Stopped"
+        speed = v["speed"]
+        status = STATUS_MOVING if speed > 0.5 else STATUS_STOPPED
         speed_str = f"{speed:.1f} mph" if speed > 0 else "parked"
         time_ago = format_time_ago(v.get("time"))
         
-        print(f"{v['name']}")
-        print(f"  Status: {status} ({speed_str})")
-        print(f"  Location: {v.get('lat', 'N/A'):.5f}, {v.get('lon', 'N/A'):.5f}")
-        print(f"  Last update: {time_ago}")
-        print()
+        lines.append(
+            f"{v['name']}\n"
+            f"  Status: {status} ({speed_str})\n"
+            f"  Location: {v.get('lat', 'N/A'):.5f}, {v.get('lon', 'N/A'):.5f}\n"
+            f"  Last update: {time_ago}\n\n"
+        )
+    sys.stdout.writelines(lines)
     
     return 0
 
 
 def cmd_near(args):
     """Find plows near a location."""
-    # Geocode the location
-    coords = geocode_location(args.location)
+    # Geocode the location and fetch vehicles concurrently; they're independent
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        coords_future = executor.submit(geocode_location, args.location)
+        vehicles_future = executor.submit(get_vehicles)
+        coords = coords_future.result()
+        vehicles = vehicles_future.result()
+    
     if not coords:
         print(f"Error: Could not find location '{args.location}'")
         return 1
@@ -271,21 +453,12 @@ def cmd_near(args):
     lat, lon = coords
     print(f"Searching near: {args.location} ({lat:.4f}, {lon:.4f})\n", file=sys.stderr)
     
-    vehicles = get_vehicles()
     if not vehicles:
         print("No vehicle data available.")
         return 1
     
     # Calculate distances
-    results = []
-    for v in vehicles:
-        if v.get("lat") and v.get("lon"):
-            dist = haversine_distance(lat, lon, v["lat"], v["lon"])
-            if dist <= args.radius:
-                results.append((v, dist))
-    
-    # Sort by distance
-    results.sort(key=lambda x: x[1])
+    results = find_nearby(lat, lon, vehicles, args.radius)
     
     if not results:
         print(f"No plows found within {args.radius} miles.")
@@ -293,15 +466,19 @@ def cmd_near(args):
     
     print(f"Found {len(results)} plows within {args.radius} miles:\n")
     
-    for v, dist in results[:args.limit]:
-        speed = v.get("speed", 0)
-        status = "🟢 Moving" if speed > 0.5 else "🔴 Stopped"
+    # Only the closest few are shown, so select them rather than sorting everything
+    lines = []
+    for v, dist in heapq.nsmallest(args.limit, results, key=lambda x: x[1]):
+        speed = v["speed"]
+        status = STATUS_MOVING if speed > 0.5 else STATUS_STOPPED
         time_ago = format_time_ago(v.get("time"))
         
-        print(f"🚛 {v['name']} — {dist:.2f} miles away")
-        print(f"   {status} ({speed:.1f} mph)")
-        print(f"   Updated: {time_ago}")
-        print()
+        lines.append(
+            f"🚛 {v['name']} — {dist:.2f} miles away\n"
+            f"   {status} ({speed:.1f} mph)\n"
+            f"   Updated: {time_ago}\n\n"
+        )
+    sys.stdout.writelines(lines)
     
     return 0
 
@@ -336,20 +513,18 @@ def cmd_check(args):
     print(f"Checking plow activity near: {address}")
     print(f"Looking back {args.hours} hours, within {args.radius} feet\n")
     
-    # Get route history
-    history = get_route_history(hours=args.hours)
+    # Get route history near the address
+    history = get_route_history(hours=args.hours, center=coords, radius_feet=args.radius)
     
-    if not history:
-        print("No route history available. There may not be recent snow activity.")
-        return 0
+    if history is None:
+        print("Error: Could not fetch route history. Try again in a few minutes.")
+        return 1
     
-    # Find points near the address
-    nearby = []
-    for point in history:
-        if point.get("lat") and point.get("lon"):
-            dist = haversine_distance(lat, lon, point["lat"], point["lon"])
-            if dist <= radius_miles:
-                nearby.append((point, dist * 5280))  # Convert back to feet
+    # Distances for display; also enforces the radius if the server filter was skipped
+    nearby = [
+        (point, dist * 5280)  # Convert back to feet
+        for point, dist in find_nearby(lat, lon, history, radius_miles)
+    ]
     
     if not nearby:
         print(f"❌ No plow activity found within {args.radius} feet of this address")
@@ -359,8 +534,8 @@ def cmd_check(args):
     # Sort by time (most recent first)
     nearby.sort(key=lambda x: x[0].get("time") or datetime.min.replace(tzinfo=timezone.utc), reverse=True)
     
-    # Get unique plows that passed
-    plows = set(p[0]["name"] for p in nearby)
+    # Count passes per plow
+    passes = Counter(p[0]["name"] for p in nearby)
     most_recent = nearby[0]
     
     print(f"✅ YES — Your street has been plowed!")
@@ -368,11 +543,10 @@ def cmd_check(args):
     print(f"   Plow: {most_recent[0]['name']}")
     print(f"   Distance: {most_recent[1]:.0f} feet from address")
     
-    if len(plows) > 1:
-        print(f"\n   {len(nearby)} total passes by {len(plows)} different plows:")
-        for plow in sorted(plows):
-            passes = [p for p in nearby if p[0]["name"] == plow]
-            print(f"     {plow}: {len(passes)} passes")
+    if len(passes) > 1:
+        print(f"\n   {len(nearby)} total passes by {len(passes)} different plows:")
+        for plow, count in sorted(passes.items()):
+            print(f"     {plow}: {count} passes")
     
     return 0
 